@@ -1,8 +1,10 @@
+import hashlib
 import logging
 import os
 import shlex
 import sys
 import warnings
+from bisect import bisect
 from configparser import (
     ConfigParser,
     InterpolationError,
@@ -12,14 +14,36 @@ from configparser import (
 )
 from functools import wraps
 from io import StringIO
-from typing import Callable, Dict, Optional, Sequence, Union
-
-from aesara.utils import hash_from_code
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
 
 _logger = logging.getLogger("aesara.configparser")
 
 
+class _Missing:
+    r"""The type of `_MISSING`, the value of unset `ConfigParam`\s."""
+
+    def __repr__(self):
+        return "_MISSING"
+
+    def __reduce__(self):
+        # Unpickle to the same sentinel
+        return "_MISSING"
+
+
+_MISSING = _Missing()
+
+
 class AesaraConfigWarning(Warning):
     @classmethod
     def warn(cls, message, stacklevel=0):
@@ -39,6 +63,9 @@ class _ChangeFlagsDecorator:
         self.confs = {k: _root._config_var_dict[k] for k in kwargs}
         self.new_vals = kwargs
         self._root = _root
+        # The parameters paired with their new values, which `__enter__` uses
+        # every time the decorated function is called
+        self._conf_new_vals = tuple((v, kwargs[k]) for k, v in self.confs.items())
 
     def __call__(self, f):
         @wraps(f)
@@ -49,20 +76,21 @@ class _ChangeFlagsDecorator:
         return res
 
     def __enter__(self):
-        self.old_vals = {}
-        for k, v in self.confs.items():
-            self.old_vals[k] = v.__get__(self._root, self._root.__class__)
+        root = self._root
+        root_type = root.__class__
+        self.old_vals = {k: v.__get__(root, root_type) for k, v in self.confs.items()}
         try:
-            for k, v in self.confs.items():
-                v.__set__(self._root, self.new_vals[k])
+            for v, new_val in self._conf_new_vals:
+                v.__set__(root, new_val)
         except Exception:
             _logger.error(f"Failed to change flags for {self.confs}.")
             self.__exit__()
             raise
 
     def __exit__(self, *args):
+        # The old values were applied and validated when they were first set
         for k, v in self.confs.items():
-            v.__set__(self._root, self.old_vals[k])
+            v._set_applied(self._root, self.old_vals[k])
 
 
 class _SectionRedirect:
@@ -93,7 +121,19 @@ class AesaraConfigParser:
         self._flags_dict = flags_dict
         self._aesara_cfg = aesara_cfg
         self._aesara_raw_cfg = aesara_raw_cfg
+        # The values found in the config files, or `None` for the keys that
+        # aren't in them
+        self._cfg_val_cache: Dict[str, Optional[str]] = {}
         self._config_var_dict: Dict = {}
+        # The `in_c_key` parameters and their names, sorted by name
+        self._c_key_params: List["ConfigParam"] = []
+        self._c_key_names: List[str] = []
+        # Incremented whenever an `in_c_key` parameter is added or changes
+        # value
+        self._config_version = 0
+        # The last result of `get_config_hash` and the version it was
+        # computed for
+        self._config_hash: Optional[Tuple[int, str]] = None
         super().__init__()
 
     def __str__(self, print_doc=True):
@@ -119,15 +159,24 @@ class AesaraConfigParser:
 
         We only take into account config options for which `in_c_key` is True.
         """
-        all_opts = sorted(
-            [c for c in self._config_var_dict.values() if c.in_c_key],
-            key=lambda cv: cv.name,
-        )
-        return hash_from_code(
-            "\n".join(
-                [f"{cv.name} = {cv.__get__(self, self.__class__)}" for cv in all_opts]
-            )
-        )
+        if (
+            self._config_hash is not None
+            and self._config_hash[0] == self._config_version
+        ):
+            return self._config_hash[1]
+
+        # This is `hash_from_code` of the newline-separated options, without
+        # building the whole string
+        sha256 = hashlib.sha256()
+        for i, cv in enumerate(self._c_key_params):
+            if i:
+                sha256.update(b"\n")
+            sha256.update(f"{cv.name} = {cv.__get__(self, self.__class__)}".encode())
+        config_hash = "m" + sha256.hexdigest()
+        # Reading the parameters can set the ones with callable defaults, so
+        # the version is only read now
+        self._config_hash = (self._config_version, config_hash)
+        return config_hash
 
     def add(self, name, doc, configparam, in_c_key=True):
         """Add a new variable to AesaraConfigParser.
@@ -160,12 +209,19 @@ class AesaraConfigParser:
             raise AttributeError(
                 f"A config parameter with the name '{name}' was already registered on another config instance."
             )
+        # The name is used as a key of several dicts
+        name = sys.intern(name)
         configparam.doc = doc
         configparam.name = name
         configparam.in_c_key = in_c_key
 
         # Register it on this instance before the code below already starts accessing it
         self._config_var_dict[name] = configparam
+        if in_c_key:
+            idx = bisect(self._c_key_names, name)
+            self._c_key_names.insert(idx, name)
+            self._c_key_params.insert(idx, configparam)
+            self._config_version += 1
 
         # Trigger a read of the value from config files and env vars
         # This allow to filter wrong value from the user.
@@ -218,24 +274,29 @@ class AesaraConfigParser:
                 return self._flags_dict.pop(key)
             return self._flags_dict[key]
 
-        # next try to find it in the config file
-
-        # config file keys can be of form option, or section__option
-        key_tokens = key.rsplit("__", 1)
-        if len(key_tokens) > 2:
+        # next try to find it in the config file.  The config files don't
+        # change, so the results are cached.
+        try:
+            val = self._cfg_val_cache[key]
+        except KeyError:
+            val = self._cfg_val_cache[key] = self._fetch_cfg_val_for_key(key)
+        if val is None:
             raise KeyError(key)
+        return val
 
-        if len(key_tokens) == 2:
-            section, option = key_tokens
-        else:
-            section, option = "global", key
+    def _fetch_cfg_val_for_key(self, key: str) -> Optional[str]:
+        """Return the config file value for a key, or ``None`` if there is none."""
+        # config file keys can be of form option, or section__option
+        section, sep, option = key.rpartition("__")
+        if not sep:
+            section = "global"
         try:
             try:
                 return self._aesara_cfg.get(section, option)
             except InterpolationError:
                 return self._aesara_raw_cfg.get(section, option)
         except (NoOptionError, NoSectionError):
-            raise KeyError(key)
+            return None
 
     def change_flags(self, *args, **kwargs) -> _ChangeFlagsDecorator:
         """
@@ -262,6 +323,18 @@ class ConfigParam:
     a property on an instance of AesaraConfigParser.
     """
 
+    __slots__ = (
+        "_default",
+        "_apply_fn",
+        "_validate",
+        "_mutable",
+        "is_default",
+        "val",
+        "name",
+        "doc",
+        "in_c_key",
+    )
+
     def __init__(
         self,
         default: Union[object, Callable[[object], object]],
@@ -288,10 +361,12 @@ class ConfigParam:
             If mutable is False, the value of this config settings can not be changed at runtime.
         """
         self._default = default
-        self._apply = apply
+        # Not `_apply`, which is the name of the subclasses' apply methods
+        self._apply_fn = apply
         self._validate = validate
         self._mutable = mutable
         self.is_default = True
+        self.val = _MISSING
         # set by AesaraConfigParser.add:
         self.name = None
         self.doc = None
@@ -317,8 +392,8 @@ class ConfigParam:
 
         Typical use cases are casting or the substitution of '~' with the user home directory.
         """
-        if callable(self._apply):
-            return self._apply(value)
+        if callable(self._apply_fn):
+            return self._apply_fn(value)
         return value
 
     def validate(self, value) -> Optional[bool]:
@@ -345,29 +420,42 @@ class ConfigParam:
                 f"The config parameter '{self.name}' was registered on a different instance of the AesaraConfigParser."
                 f" It is not accessible through the instance with id '{id(cls)}' because of safeguarding."
             )
-        if not hasattr(self, "val"):
-            try:
-                val_str = cls.fetch_val_for_key(self.name, delete_key=delete_key)
-                self.is_default = False
-            except KeyError:
-                if callable(self.default):
-                    val_str = self.default()
-                else:
-                    val_str = self.default
-            self.__set__(cls, val_str)
+        val = self.val
+        if val is not _MISSING:
+            return val
+
+        try:
+            val_str = cls.fetch_val_for_key(self.name, delete_key=delete_key)
+            self.is_default = False
+        except KeyError:
+            if callable(self.default):
+                val_str = self.default()
+            else:
+                val_str = self.default
+        self.__set__(cls, val_str)
         return self.val
 
     def __set__(self, cls, val):
-        if not self.mutable and hasattr(self, "val"):
+        if not self.mutable and self.val is not _MISSING:
             raise Exception(
                 f"Can't change the value of {self.name} config parameter after initialization!"
             )
         applied = self.apply(val)
         self.validate(applied)
+        self._set_applied(cls, applied)
+
+    def _set_applied(self, cls, applied):
+        """Set a value that has already been applied and validated."""
+        old_val = self.val
         self.val = applied
+        if self.in_c_key and applied != old_val:
+            # The C key of the config instance has changed
+            cls._config_version += 1
 
 
 class EnumStr(ConfigParam):
+    __slots__ = ("all",)
+
     def __init__(
         self, default: str, options: Sequence[str], validate=None, mutable=True
     ):
@@ -385,7 +473,7 @@ class EnumStr(ConfigParam):
         mutable : callable
             See `ConfigParam`.
         """
-        self.all = {default, *options}
+        self.all = frozenset((default, *options))
 
         # All options should be strings
         for val in self.all:
@@ -394,59 +482,85 @@ class EnumStr(ConfigParam):
         super().__init__(default, apply=self._apply, validate=validate, mutable=mutable)
 
     def _apply(self, val):
-        if val in self.all:
+        # Assigning the default itself doesn't need to hash `val`
+        if val is self._default or val in self.all:
             return val
         else:
             raise ValueError(
                 f"Invalid value ('{val}') for configuration variable '{self.name}'. "
-                f"Valid options are {self.all}"
+                f"Valid options are {set(self.all)}"
             )
 
     def __str__(self):
-        return f"{self.name} ({self.all}) "
+        return f"{self.name} ({set(self.all)}) "
 
 
 class TypedParam(ConfigParam):
+    __slots__ = ()
+
     def __str__(self):
-        # The "_apply" callable is the type itself.
-        return f"{self.name} ({self._apply}) "
+        # The "_apply_fn" callable is the type itself.
+        return f"{self.name} ({self._apply_fn}) "
 
 
 class StrParam(TypedParam):
+    __slots__ = ()
+
     def __init__(self, default, validate=None, mutable=True):
         super().__init__(default, apply=str, validate=validate, mutable=mutable)
 
 
 class IntParam(TypedParam):
+    __slots__ = ()
+
     def __init__(self, default, validate=None, mutable=True):
         super().__init__(default, apply=int, validate=validate, mutable=mutable)
 
 
 class FloatParam(TypedParam):
+    __slots__ = ()
+
     def __init__(self, default, validate=None, mutable=True):
         super().__init__(default, apply=float, validate=validate, mutable=mutable)
 
 
+# The values accepted by `BoolParam`.  ``0`` and ``1`` are equal to, and hash
+# like, `False` and `True`, so they are covered by those keys.
+_BOOL_VALUES = {
+    False: False,
+    "false": False,
+    "False": False,
+    "0": False,
+    True: True,
+    "true": True,
+    "True": True,
+    "1": True,
+}
+
+
 class BoolParam(TypedParam):
     """A boolean parameter that may be initialized from any of the following:
     False, 0, "false", "False", "0"
     True, 1, "true", "True", "1"
     """
 
+    __slots__ = ()
+
     def __init__(self, default, validate=None, mutable=True):
         super().__init__(default, apply=self._apply, validate=validate, mutable=mutable)
 
     def _apply(self, value):
-        if value in {False, 0, "false", "False", "0"}:
-            return False
-        elif value in {True, 1, "true", "True", "1"}:
-            return True
-        raise ValueError(
-            f"Invalid value ({value}) for configuration variable '{self.name}'."
-        )
+        try:
+            return _BOOL_VALUES[value]
+        except KeyError:
+            raise ValueError(
+                f"Invalid value ({value}) for configuration variable '{self.name}'."
+            )
 
 
 class DeviceParam(ConfigParam):
+    __slots__ = ()
+
     def __init__(self, default, *options, **kwargs):
         super().__init__(
             default, apply=self._apply, mutable=kwargs.get("mutable", True)
@@ -462,8 +576,8 @@ class DeviceParam(ConfigParam):
             return val
         else:
             raise ValueError(
-                'Invalid value ("{val}") for configuration '
-                'variable "{self.name}". Valid options start with '
+                f'Invalid value ("{val}") for configuration '
+                f'variable "{self.name}". Valid options start with '
                 'one of "cpu".'
             )
 
@@ -472,6 +586,8 @@ class DeviceParam(ConfigParam):
 
 
 class ContextsParam(ConfigParam):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__("", apply=self._apply, mutable=False)
 
@@ -492,24 +608,32 @@ def parse_config_string(config_string, issue_warnings=True):
     Parses a config string (comma-separated key=value components) into a dict.
     """
     config_dict = {}
-    my_splitter = shlex.shlex(config_string, posix=True)
-    my_splitter.whitespace = ","
-    my_splitter.whitespace_split = True
-    for kv_pair in my_splitter:
+    if any(c in config_string for c in "'\"\\#"):
+        # Let `shlex` handle the quotes, escapes and comments
+        my_splitter = shlex.shlex(config_string, posix=True)
+        my_splitter.whitespace = ","
+        my_splitter.whitespace_split = True
+        kv_pairs: Iterable[str] = my_splitter
+    else:
+        kv_pairs = config_string.split(",")
+    for kv_pair in kv_pairs:
         kv_pair = kv_pair.strip()
         if not kv_pair:
             continue
         kv_tuple = kv_pair.split("=", 1)
         if len(kv_tuple) == 1:
             if issue_warnings:
-                AesaraConfigWarning.warn(
-                    f"Config key '{kv_tuple[0]}' has no value, ignoring it",
-                    stacklevel=1,
+                warnings.warn(
+                    f"Config key '{kv_pair}' has no value, ignoring it",
+                    AesaraConfigWarning,
+                    stacklevel=3,
                 )
         else:
             k, v = kv_tuple
-            # subsequent values for k will override earlier ones
-            config_dict[k] = v
+            # subsequent values for k will override earlier ones.  The keys
+            # are interned like the names of the config parameters they're
+            # looked up with.
+            config_dict[sys.intern(k)] = v
     return config_dict
 
 
@@ -522,16 +646,59 @@ def config_files_from_aesararc():
     In that case, definitions in files on the right (here, ``~/.aesararc``)
     have precedence over those in files on the left.
     """
+    aesararc = os.getenv("AESARARC")
     rval = [
         os.path.expanduser(s)
-        for s in os.getenv("AESARARC", "~/.aesararc").split(os.pathsep)
+        for s in (aesararc if aesararc is not None else "~/.aesararc").split(os.pathsep)
     ]
-    if os.getenv("AESARARC") is None and sys.platform == "win32":
+    if aesararc is None and sys.platform == "win32":
         # to don't need to change the filename and make it open easily
         rval.append(os.path.expanduser("~/.aesararc.txt"))
     return rval
 
 
+# The latest parse of the config files, indexed by the parser type, its
+# defaults and the paths of the files, along with the paths, modification
+# times and sizes of the files that were read
+_PARSED_RC_CACHE: Dict[Tuple, Tuple[Tuple, RawConfigParser]] = {}
+
+
+def _read_config_files(
+    parser_type: Type[RawConfigParser],
+    defaults: Optional[Dict[str, str]],
+    config_files: Sequence[str],
+) -> RawConfigParser:
+    """Return a `parser_type` instance that has read `config_files`.
+
+    The parsers are reused for as long as the files don't change, so they must
+    not be modified.
+    """
+    files_key = []
+    for config_file in config_files:
+        try:
+            stat = os.stat(config_file)
+        except OSError:
+            # `RawConfigParser.read` skips the files that can't be opened
+            continue
+        files_key.append((config_file, stat.st_mtime_ns, stat.st_size))
+
+    key = (
+        parser_type,
+        tuple(sorted(defaults.items())) if defaults else None,
+        tuple(config_files),
+    )
+    files_stamp = tuple(files_key)
+    cached = _PARSED_RC_CACHE.get(key)
+    if cached is not None and cached[0] == files_stamp:
+        return cached[1]
+
+    # Any previous parse of these files is stale, so it's replaced
+    parser = parser_type(defaults)
+    parser.read([config_file for config_file, _, _ in files_key])
+    _PARSED_RC_CACHE[key] = (files_stamp, parser)
+    return parser
+
+
 def _create_default_config():
     # The AESARA_FLAGS environment variable should be a list of comma-separated
     # [section__]option=value entries. If the section part is omitted, there should
@@ -540,22 +707,34 @@ def _create_default_config():
     AESARA_FLAGS_DICT = parse_config_string(AESARA_FLAGS, issue_warnings=True)
 
     config_files = config_files_from_aesararc()
-    aesara_cfg = ConfigParser(
+    environ = os.environ
+    user = environ.get("USER")
+    if user is None:
+        # Only look the home directory up when it's needed
+        user = os.path.split(os.path.expanduser("~"))[-1]
+    aesara_cfg = _read_config_files(
+        ConfigParser,
         {
-            "USER": os.getenv("USER", os.path.split(os.path.expanduser("~"))[-1]),
-            "LSCRATCH": os.getenv("LSCRATCH", ""),
-            "TMPDIR": os.getenv("TMPDIR", ""),
-            "TEMP": os.getenv("TEMP", ""),
-            "TMP": os.getenv("TMP", ""),
+            "USER": user,
+            "LSCRATCH": environ.get("LSCRATCH", ""),
+            "TMPDIR": environ.get("TMPDIR", ""),
+            "TEMP": environ.get("TEMP", ""),
+            "TMP": environ.get("TMP", ""),
             "PID": str(os.getpid()),
-        }
+        },
+        config_files,
     )
-    aesara_cfg.read(config_files)
     # Having a raw version of the config around as well enables us to pass
     # through config values that contain format strings.
-    # The time required to parse the config twice is negligible.
+    # The raw values are copied from the parsed files instead of parsing them
+    # a second time.
     aesara_raw_cfg = RawConfigParser()
-    aesara_raw_cfg.read(config_files)
+    aesara_raw_cfg.read_dict(
+        {
+            section: dict(aesara_cfg.items(section, raw=True))
+            for section in aesara_cfg.sections()
+        }
+    )
 
     # Instances of AesaraConfigParser can have independent current values!
     # But because the properties are assigned to the type, their existence is global.
@@ -1,4 +1,6 @@
 import traceback
+import weakref
+from itertools import chain
 from typing import (
     TYPE_CHECKING,
     Callable,
@@ -73,6 +75,67 @@ if TYPE_CHECKING:
     ]
 
 
+_SHAPE_I_CACHE: Dict[int, Shape_i] = {}
+
+
+def _shape_i_op(i: int) -> Shape_i:
+    """Return a shared `Shape_i` instance for dimension `i`."""
+    op = _SHAPE_I_CACHE.get(i)
+    if op is None:
+        op = _SHAPE_I_CACHE[i] = Shape_i(i)
+    return op
+
+
+def _is_ancestor(target: Variable, root: Variable) -> bool:
+    """Return ``True`` if `target` is `root` or one of its ancestors.
+
+    Unlike ``target in ancestors([root])``, the search stops as soon as
+    `target` is found.
+
+    """
+    visited: Set[Variable] = set()
+    to_visit = [root]
+    while to_visit:
+        var = to_visit.pop()
+        if var is target:
+            return True
+        if var in visited:
+            continue
+        visited.add(var)
+        if var.owner is not None:
+            to_visit.extend(var.owner.inputs)
+    return False
+
+
+def _dims_trivially_equal(dx: Variable, dy: Variable) -> Optional[bool]:
+    """Compare the shape elements `dx` and `dy` without canonicalizing them.
+
+    Returns ``None`` when the comparison requires canonicalization.
+
+    """
+    if dx is dy:
+        return True
+
+    cx = extract_constant(dx, only_process_constants=True)
+    cy = extract_constant(dy, only_process_constants=True)
+    if not isinstance(cx, Variable) and not isinstance(cy, Variable):
+        return bool(cx == cy)
+
+    x_node = dx.owner
+    y_node = dy.owner
+    if (
+        x_node is not None
+        and y_node is not None
+        and isinstance(x_node.op, Shape_i)
+        and isinstance(y_node.op, Shape_i)
+        and x_node.op.i == y_node.op.i
+        and x_node.inputs[0] is y_node.inputs[0]
+    ):
+        return True
+
+    return None
+
+
 class ShapeFeature(Feature):
     r"""A `Feature` that tracks shape information in a graph.
 
@@ -125,14 +188,12 @@ class ShapeFeature(Feature):
         except AttributeError:
             shape_infer = self.default_infer_shape
 
+        i_shapes = [self.shape_of[r] for r in node.inputs]
+
         try:
-            o_shapes = shape_infer(
-                fgraph, node, [self.shape_of[r] for r in node.inputs]
-            )
+            o_shapes = shape_infer(fgraph, node, i_shapes)
         except ShapeError:
-            o_shapes = self.default_infer_shape(
-                fgraph, node, [self.shape_of[r] for r in node.inputs]
-            )
+            o_shapes = self.default_infer_shape(fgraph, node, i_shapes)
         except NotImplementedError as e:
             raise NotImplementedError(
                 "Code called by infer_shape failed raising a "
@@ -144,97 +205,123 @@ class ShapeFeature(Feature):
         except Exception as e:
             msg = (
                 f"Failed to infer_shape from Op {node.op}.\nInput shapes: "
-                f"{[self.shape_of[r] for r in node.inputs]}\nException encountered during infer_shape: "
-                f"{type(e)}\nException message: {str(e)}\nTraceback: {traceback.format_exc()}"
+                f"{i_shapes}\nException encountered during infer_shape: "
+                f"{type(e)}\nException message: {str(e)}"
             )
             if config.on_shape_error == "raise":
+                # Formatting the traceback is expensive, so it's only done
+                # when the error is raised
+                msg += f"\nTraceback: {traceback.format_exc()}"
                 raise Exception(msg).with_traceback(e.__traceback__)
             else:
                 warn(msg)
-            o_shapes = self.default_infer_shape(
-                fgraph, node, [self.shape_of[r] for r in node.inputs]
-            )
+            o_shapes = self.default_infer_shape(fgraph, node, i_shapes)
 
         return o_shapes
 
-    def get_shape(self, fgraph: FunctionGraph, var: Variable, idx: int) -> Variable:
-        """Get the shape of `var` at index `idx`.
-
-        It is better to call this than use ``ShapeFeature.shape_of[var][idx]``,
-        since this method will update `ShapeFeature.shape_of` when needed.
-
-        TODO: Up to now, we don't update it in all cases. Update in all cases.
-
-        """
+    def _is_stale(self, fgraph: FunctionGraph, var: Variable, idx: int) -> bool:
+        """Determine whether or not ``shape_of[var][idx]`` refers to a `Variable` that
+        is no longer in `fgraph`."""
         var_shape = self.shape_of[var]
         assert var_shape is not None
 
         var_idx_shape = var_shape[idx]
-
-        if (
+        return bool(
             var_idx_shape.owner
             and isinstance(var_idx_shape.owner.op, Shape_i)
             and var_idx_shape.owner.inputs[0] not in fgraph.variables
-        ):
-            assert var.owner
-            node = var.owner
-
-            # Recurse on inputs
-            # TODO FIXME: Remove the recursion here.
-            for i in node.inputs:
-                if isinstance(i.type, HasShape):
-                    self.get_shape(fgraph, i, 0)
-
-            o_shapes = self.get_node_infer_shape(fgraph, node)
-            assert len(o_shapes) == len(node.outputs)
-
-            # Only change the variables and dimensions that would introduce
-            # extra computation
-            for new_shps, out in zip(o_shapes, node.outputs):
-                if not isinstance(out.type, HasShape):
-                    continue
+        )
+
+    def _update_node_shapes(self, fgraph: FunctionGraph, node: "Apply") -> None:
+        """Re-infer the stale output shapes of `node`."""
+        o_shapes = self.get_node_infer_shape(fgraph, node)
+        assert len(o_shapes) == len(node.outputs)
+
+        # Only change the variables and dimensions that would introduce
+        # extra computation
+        for new_shps, out in zip(o_shapes, node.outputs):
+            if not isinstance(out.type, HasShape):
+                continue
+
+            out_shape = self.shape_of[out]
+            assert out_shape is not None
 
-                out_shape = self.shape_of[out]
-                assert out_shape is not None
+            merged_shps = list(out_shape)
 
-                merged_shps = list(out_shape)
+            changed = False
+            for i in range(out.type.ndim):
+                n_r = merged_shps[i]
+                if (
+                    n_r.owner
+                    and isinstance(n_r.owner.op, Shape_i)
+                    and n_r.owner.inputs[0] not in fgraph.variables
+                ):
+                    changed = True
+
+                    assert new_shps is not None
+
+                    merged_shps[i] = new_shps[i]
+
+            if changed:
+                self.set_shape(out, merged_shps, override=True)
+                self.useless_reshape_cache.clear()
+                self.get_shape_cache.clear()
+
+    def get_shape(self, fgraph: FunctionGraph, var: Variable, idx: int) -> Variable:
+        """Get the shape of `var` at index `idx`.
+
+        It is better to call this than use ``ShapeFeature.shape_of[var][idx]``,
+        since this method will update `ShapeFeature.shape_of` when needed.
 
-                changed = False
-                for i in range(out.type.ndim):
-                    n_r = merged_shps[i]
-                    if (
-                        n_r.owner
-                        and isinstance(n_r.owner.op, Shape_i)
-                        and n_r.owner.inputs[0] not in fgraph.variables
-                    ):
-                        changed = True
+        TODO: Up to now, we don't update it in all cases. Update in all cases.
 
-                        assert new_shps is not None
+        """
+        # The inputs of a node with stale shapes are updated before the node
+        # itself, so this is a post-order walk.  An entry of `stack` is either
+        # a ``(var, idx)`` pair that needs to be checked, or a node (tagged with
+        # ``None``) whose inputs have all been updated.
+        stack: List[Tuple[Union[Variable, "Apply"], Optional[int]]] = [(var, idx)]
+        visited: Set[int] = set()
+        while stack:
+            item, item_idx = stack.pop()
+
+            if item_idx is None:
+                self._update_node_shapes(fgraph, type_cast("Apply", item))
+                continue
 
-                        merged_shps[i] = new_shps[i]
+            item = type_cast(Variable, item)
+            if not self._is_stale(fgraph, item, item_idx):
+                continue
 
-                if changed:
-                    self.set_shape(out, merged_shps, override=True)
+            assert item.owner
+            node = item.owner
 
-            var_shape = self.shape_of[var]
-            assert var_shape is not None
+            if id(node) in visited:
+                continue
+            visited.add(id(node))
 
-            var_idx_shape = var_shape[idx]
+            stack.append((node, None))
+            stack.extend(
+                (i, 0) for i in reversed(node.inputs) if isinstance(i.type, HasShape)
+            )
 
-        return var_idx_shape
+        var_shape = self.shape_of[var]
+        assert var_shape is not None
+
+        return var_shape[idx]
 
     def shape_ir(self, i: int, r: Variable) -> Variable:
         r"""Return symbolic `r.shape[i]`."""
         if isinstance(r.type, HasShape) and r.type.shape[i] is not None:
-            return constant(r.type.shape[i], dtype="int64", ndim=0)
+            return self._int64_scalar(int(r.type.shape[i]))
         else:
             # Do not call make_node for test_value
-            s = Shape_i(i)(r)
+            s = _shape_i_op(i)(r)
 
             assert isinstance(s, Variable)
 
             try:
-                s = constant(get_scalar_constant_value(s), dtype="int64", ndim=0)
+                s = self._int64_scalar(int(get_scalar_constant_value(s)))
             except NotScalarConstantError:
                 pass
 
@@ -245,7 +332,8 @@ class ShapeFeature(Feature):
         if not isinstance(r.type, HasShape):
             # This happen for NoneConst.
             return None
-        return tuple(self.shape_ir(i, r) for i in range(r.type.ndim))
+        shape_ir = self.shape_ir
+        return tuple(shape_ir(i, r) for i in range(r.type.ndim))
 
     def default_infer_shape(
         self, fgraph: FunctionGraph, node: "Apply", i_shapes: "InputShapesType"
@@ -286,27 +374,28 @@ class ShapeFeature(Feature):
             isinstance(s_i, np.ndarray) and s_i.ndim == 0
         ):
             assert int(s_i) == s_i and s_i >= 0
-            return constant(s_i, dtype="int64", ndim=0)
+            return self._int64_scalar(int(s_i))
 
         assert isinstance(s_i, Variable)
 
         # TODO FIXME: This is eager canonicalization; we should let the
         # relevant canonicalization passes do their job and not perform the
         # same logic manually.
-        if (
-            s_i.owner
-            and isinstance(s_i.owner.op, Subtensor)
-            and s_i.owner.inputs[0].owner
-            and isinstance(s_i.owner.inputs[0].owner.op, Shape)
-        ):
+        node = s_i.owner
+        shape_node = (
+            node.inputs[0].owner
+            if node is not None and isinstance(node.op, Subtensor)
+            else None
+        )
+        if shape_node is not None and isinstance(shape_node.op, Shape):
             # s_i is x.shape[i] for some x, we change it to shape_of[x][i]
             assert s_i.type.ndim == 0
-            assert len(s_i.owner.op.idx_list) == 1
+            assert len(node.op.idx_list) == 1
 
             # The current Subtensor always put constant index in the graph.
             # This was not True in the past. So call the Subtensor function
             # that will return the right index.
-            idx = get_idx_list(s_i.owner.inputs, s_i.owner.op.idx_list)
+            idx = get_idx_list(node.inputs, node.op.idx_list)
             assert len(idx) == 1
             idx = idx[0]
             try:
@@ -315,7 +404,7 @@ class ShapeFeature(Feature):
                 return s_i
             else:
                 # Executed only if no exception was raised
-                x = s_i.owner.inputs[0].owner.inputs[0]
+                x = shape_node.inputs[0]
                 # x should already have been imported, and should be in shape_of.
                 s_x = self.shape_of[x]
                 assert s_x is not None
@@ -355,25 +444,32 @@ class ShapeFeature(Feature):
                     f"a variable with {int(r.type.ndim)} dimensions."
                 )
 
-            shape_vars: Tuple[Variable, ...] = ()
-            for i in range(r.type.ndim):
-                if isinstance(r.type, HasShape) and r.type.shape[i] is not None:
-                    shape_vars += (constant(r.type.shape[i], dtype="int64", ndim=0),)
-                else:
-                    shape_vars += (self.to_symbolic_int(s[i]),)
+            static_shape = r.type.shape if isinstance(r.type, HasShape) else None
 
-            assert all(
-                not isinstance(r.type, HasShape)
-                or r.type.shape[i] != 1
-                or self.lscalar_one.equals(shape_vars[i])
-                or self.lscalar_one.equals(extract_constant(shape_vars[i]))
-                for i in range(r.type.ndim)
-            )
+            shape_vars: List[Variable]
+            if static_shape is not None and None not in static_shape:
+                # When the static shape is fully known, the inferred shape
+                # isn't used at all
+                shape_vars = [self._int64_scalar(int(d)) for d in static_shape]
+            else:
+                shape_vars = []
+                for i in range(r.type.ndim):
+                    if static_shape is not None and static_shape[i] is not None:
+                        shape_vars.append(self._int64_scalar(int(static_shape[i])))
+                    else:
+                        shape_vars.append(self.to_symbolic_int(s[i]))
+
+                if static_shape is not None:
+                    assert all(
+                        static_shape[i] != 1
+                        or self.lscalar_one.equals(shape_vars[i])
+                        or self.lscalar_one.equals(extract_constant(shape_vars[i]))
+                        for i in range(r.type.ndim)
+                    )
 
             self.shape_of[r] = tuple(shape_vars)
 
-            for sv in shape_vars:
-                self.shape_of_reverse_index.setdefault(sv, set()).add(r)
+            self._update_reverse_index(r, shape_vars)
 
     def update_shape(self, r: Variable, other_r: Variable) -> None:
         """Replace shape of `r` by shape of `other_r`.
@@ -408,11 +504,15 @@ class ShapeFeature(Feature):
             # frequently.
             return
 
+        if other_shape == r_shape:
+            # Merging would leave the shape of `r` unchanged
+            return
+
         # Merge other_shape with r_shape, giving the priority to other_shape
-        merged_shape: Tuple[Variable, ...] = ()
+        merged_shape: List[Variable] = []
         for i, ps in enumerate(other_shape):
             if r_shape is None:
-                merged_shape += (ps,)
+                merged_shape.append(ps)
                 continue
 
             rs = r_shape[i]
@@ -428,21 +528,17 @@ class ShapeFeature(Feature):
                 # For now, we consider 2 cases of uninformative other_shape[i]:
                 #  - Shape_i(i)(other_r);
                 #  - Shape_i(i)(r).
-                merged_shape += (rs,)
+                merged_shape.append(rs)
             elif isinstance(rs, Constant):
                 # We always prefer constants
-                merged_shape += (rs,)
+                merged_shape.append(rs)
             elif isinstance(ps, Constant):
-                merged_shape += (ps,)
+                merged_shape.append(ps)
             elif ps == rs:
                 # The shapes are equivalent.  We do not want to do the ancestor
                 # check in those cases
-                merged_shape += (rs,)
-            elif (
-                # TODO FIXME: This could be unnecessarily costly.
-                rs
-                in ancestors([ps])
-            ):
+                merged_shape.append(rs)
+            elif _is_ancestor(rs, ps):
                 # Another case where we want to use r_shape[i] is when
                 # other_shape[i] actually depends on r_shape[i]. In that case,
                 # we do not want to substitute an expression with another that
@@ -450,26 +546,24 @@ class ShapeFeature(Feature):
                 # to cycles: if (in the future) r_shape[i] gets replaced by an
                 # expression of other_shape[i], other_shape[i] may end up
                 # depending on itself.
-                merged_shape += (rs,)
+                merged_shape.append(rs)
             else:
-                merged_shape += (ps,)
+                merged_shape.append(ps)
 
-        assert all(
-            (
-                not isinstance(r.type, HasShape)
-                or r.type.shape[i] != 1
-                and other_r.type.shape[i] != 1
-            )
-            or self.lscalar_one.equals(merged_shape[i])
-            or self.lscalar_one.equals(
-                extract_constant(merged_shape[i], only_process_constants=True)
+        if isinstance(r.type, HasShape):
+            static_shape = r.type.shape
+            other_static_shape = other_r.type.shape
+            assert all(
+                (static_shape[i] != 1 and other_static_shape[i] != 1)
+                or self.lscalar_one.equals(merged_shape[i])
+                or self.lscalar_one.equals(
+                    extract_constant(merged_shape[i], only_process_constants=True)
+                )
+                for i in range(r.type.ndim)
             )
-            for i in range(r.type.ndim)
-        )
 
-        self.shape_of[r] = merged_shape
-        for sv in merged_shape:
-            self.shape_of_reverse_index.setdefault(sv, set()).add(r)
+        self.shape_of[r] = tuple(merged_shape)
+        self._update_reverse_index(r, merged_shape)
 
     def set_shape_i(self, r: Variable, i: int, s_i: Variable) -> None:
         """Replace element i of shape_of[r] by s_i"""
@@ -479,25 +573,41 @@ class ShapeFeature(Feature):
 
         # prev_shape is a tuple, so we cannot change it inplace,
         # so we build another one.
-        new_shape: Tuple[Variable, ...] = ()
-        for j, s_j in enumerate(prev_shape):
-            if j == i:
-                new_shape += (self.to_symbolic_int(s_i),)
-            else:
-                new_shape += (s_j,)
-
-        assert all(
-            not isinstance(r.type, HasShape)
-            or r.type.shape[idx] != 1
-            or self.lscalar_one.equals(new_shape[idx])
-            or self.lscalar_one.equals(extract_constant(new_shape[idx]))
-            for idx in range(r.type.ndim)
-        )
+        new_shape = list(prev_shape)
+        new_shape[i] = self.to_symbolic_int(s_i)
 
-        self.shape_of[r] = new_shape
+        if isinstance(r.type, HasShape):
+            static_shape = r.type.shape
+            assert all(
+                static_shape[idx] != 1
+                or self.lscalar_one.equals(new_shape[idx])
+                or self.lscalar_one.equals(extract_constant(new_shape[idx]))
+                for idx in range(r.type.ndim)
+            )
 
-        for sv in new_shape:
-            self.shape_of_reverse_index.setdefault(sv, set()).add(r)
+        self.shape_of[r] = tuple(new_shape)
+
+        self._update_reverse_index(r, new_shape)
+
+    def _update_reverse_index(self, r: Variable, shape: Sequence[Variable]) -> None:
+        """Record that `r` has the shape elements in `shape`."""
+        reverse_index = self.shape_of_reverse_index
+        for sv in shape:
+            dependents = reverse_index.get(sv)
+            if dependents is None:
+                dependents = reverse_index[sv] = weakref.WeakSet()
+            dependents.add(r)
+
+    def _schedule(self, shpnode: "Apply", new_r: Variable) -> None:
+        """Schedule the `Shape_i` node `shpnode` to use the shape of `new_r`."""
+        old_r = self.scheduled.get(shpnode)
+        if old_r is not None:
+            old_nodes = self.scheduled_by_var[old_r]
+            old_nodes.discard(shpnode)
+            if not old_nodes:
+                del self.scheduled_by_var[old_r]
+        self.scheduled[shpnode] = new_r
+        self.scheduled_by_var.setdefault(new_r, set()).add(shpnode)
 
     def init_r(self, r: Variable) -> None:
         """Register r's shape in the shape_of dictionary."""
@@ -509,6 +619,15 @@ class ShapeFeature(Feature):
         assert r_shape is not None
         return as_tensor_variable(r_shape, ndim=1, dtype="int64")
 
+    def _int64_scalar(self, v: int) -> Constant:
+        """Return a scalar ``int64`` `Constant` with value `v` that is shared
+        by all the shapes of this `ShapeFeature`."""
+        v = int(v)
+        c = self._int64_scalars.get(v)
+        if c is None:
+            c = self._int64_scalars[v] = constant(v, dtype="int64", ndim=0)
+        return c
+
     def on_attach(self, fgraph):
         if hasattr(fgraph, "shape_feature"):
             raise AlreadyThere("This FunctionGraph already has a ShapeFeature")
@@ -519,27 +638,80 @@ class ShapeFeature(Feature):
 
         self.shape_of: Dict[Variable, Optional[Tuple[Variable, ...]]] = {}
         self.scheduled: Dict["Apply", Variable] = {}
-        self.shape_of_reverse_index: Dict[Variable, Set[Variable]] = {}
+        # The nodes in `scheduled` indexed by their replacement variable
+        self.scheduled_by_var: Dict[Variable, Set["Apply"]] = {}
+        self._canon_shape_cache: Dict[Variable, Variable] = {}
+        # The scalar shape constants returned by `_int64_scalar`, indexed by
+        # their values
+        self._int64_scalars: Dict[int, Constant] = {}
+        # The results of `local_useless_reshape`'s shape matching, indexed by
+        # the `Reshape` inputs
+        self.useless_reshape_cache: Dict[Tuple[Variable, Variable], bool] = {}
+        # The results of `ShapeFeature.get_shape` used by
+        # `local_useless_reshape`, indexed by ``(var, idx)``
+        self.get_shape_cache: Dict[Tuple[Variable, int], Variable] = {}
+        # The keys and values are held weakly, so that entries for shape
+        # elements and variables that have been deleted are pruned
+        # automatically.
+        self.shape_of_reverse_index: weakref.WeakKeyDictionary = (
+            weakref.WeakKeyDictionary()
+        )
 
+        on_import = self.on_import
         for node in fgraph.toposort():
-            self.on_import(fgraph, node, reason="on_attach")
+            on_import(fgraph, node, reason="on_attach")
 
     def on_detach(self, fgraph):
         self.shape_of.clear()
         self.scheduled.clear()
+        self.scheduled_by_var.clear()
+        self._canon_shape_cache.clear()
+        self._int64_scalars.clear()
+        self.useless_reshape_cache.clear()
+        self.get_shape_cache.clear()
         self.shape_of_reverse_index.clear()
         del fgraph.shape_feature
 
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        # Weak references can't be pickled
+        if "shape_of_reverse_index" in d:
+            d["shape_of_reverse_index"] = {
+                k: list(v) for k, v in self.shape_of_reverse_index.items()
+            }
+        return d
+
+    def __setstate__(self, d):
+        reverse_index = d.pop("shape_of_reverse_index", None)
+        self.__dict__.update(d)
+        if reverse_index is not None:
+            self.shape_of_reverse_index = weakref.WeakKeyDictionary(
+                {k: weakref.WeakSet(v) for k, v in reverse_index.items()}
+            )
+
     def on_import(self, fgraph, node, reason):
-        if node.outputs[0] in self.shape_of:
+        shape_of = self.shape_of
+
+        if node.outputs[0] in shape_of:
             # this is a revert, not really an import
             for r in node.outputs + node.inputs:
-                assert r in self.shape_of
+                assert r in shape_of
             return
 
-        for i, r in enumerate(node.inputs):
+        for r in node.inputs:
             # make sure we have shapes for the inputs
-            self.init_r(r)
+            if r not in shape_of:
+                self.set_shape(r, self.shape_tuple(r))
+
+        if all(
+            isinstance(r.type, HasShape) and None not in r.type.shape
+            for r in node.outputs
+        ):
+            # `set_shape` only uses the static shapes in this case, so there's
+            # no need to infer them
+            for r in node.outputs:
+                self.set_shape(r, tuple(self._int64_scalar(d) for d in r.type.shape))
+            return
 
         o_shapes = self.get_node_infer_shape(fgraph, node)
 
@@ -563,32 +735,38 @@ class ShapeFeature(Feature):
                     f"infer_shape of {node} didn't return a list of"
                     f" list. It returned '{o_shapes}'"
                 )
-            new_shape = []
-            for i, d in enumerate(sh):
-                # Note: we ignore any shape element that is not typed (i.e.,
-                # does not have a 'dtype' attribute). This means there may
-                # still remain int elements that are int32 on 32-bit platforms,
-                # but this works with `local_useless_subtensor`, so for now we
-                # keep it this way. See #266 for a better long-term fix.
-                if getattr(d, "dtype", "int64") != "int64":
-                    assert d.dtype in discrete_dtypes, (node, d.dtype)
-                    assert str(d.dtype) != "uint64", node
-                    new_shape += sh[len(new_shape) : i + 1]
-                    if isinstance(d, Constant):
-                        casted_d = constant(d.data, dtype="int64", ndim=0)
-                    else:
-                        casted_d = cast(d, "int64")
-                    new_shape[i] = casted_d
-            if new_shape:
-                # We replace the shape with wrong dtype by the one with
-                # 'int64'.
-                new_shape += sh[len(new_shape) :]
-                o_shapes[sh_idx] = tuple(new_shape)
+            # Note: we ignore any shape element that is not typed (i.e., does
+            # not have a 'dtype' attribute). This means there may still remain
+            # int elements that are int32 on 32-bit platforms, but this works
+            # with `local_useless_subtensor`, so for now we keep it this way.
+            # See #266 for a better long-term fix.
+            needs_cast = [
+                i for i, d in enumerate(sh) if getattr(d, "dtype", "int64") != "int64"
+            ]
+            if not needs_cast:
+                continue
+
+            # We replace the shape with wrong dtype by the one with 'int64'.
+            new_shape = list(sh)
+            for i in needs_cast:
+                d = sh[i]
+                assert d.dtype in discrete_dtypes, (node, d.dtype)
+                assert str(d.dtype) != "uint64", node
+                if isinstance(d, Constant):
+                    new_shape[i] = self._int64_scalar(int(d.data))
+                else:
+                    new_shape[i] = cast(d, "int64")
+            o_shapes[sh_idx] = tuple(new_shape)
 
         for r, s in zip(node.outputs, o_shapes):
             self.set_shape(r, s)
 
     def on_change_input(self, fgraph, node, i, r, new_r, reason):
+        # The graphs of the cached canonical shapes may have changed
+        self._canon_shape_cache.clear()
+        self.useless_reshape_cache.clear()
+        self.get_shape_cache.clear()
+
         if new_r not in self.shape_of:
             # It happen that the fgraph didn't called on_import for some
             # new_r.  This happen when new_r don't have an
@@ -608,7 +786,7 @@ class ShapeFeature(Feature):
         # replace the shape_i of r with the shape of new_r.  Say that
         # r is *scheduled*.
         # At that point, node is no longer a client of r, but of new_r
-        for shpnode, idx in fgraph.clients[r] + [(node, i)]:
+        for shpnode, idx in chain(fgraph.clients[r], ((node, i),)):
             if isinstance(getattr(shpnode, "op", None), Shape_i):
                 idx = shpnode.op.i
                 repl = self.shape_of[new_r][idx]
@@ -634,27 +812,25 @@ class ShapeFeature(Feature):
                         f"node: {node}, i: {i}, r: {r}, new_r: {new_r}"
                     )
 
-                self.scheduled[shpnode] = new_r
+                self._schedule(shpnode, new_r)
         # In case 2, if r is a variable that we've scheduled for shape update,
         # then we should cancel it.
-        unscheduled = [k for k, v in self.scheduled.items() if v == r]
-        for k in unscheduled:
+        for k in self.scheduled_by_var.pop(r, ()):
             del self.scheduled[k]
 
         # In either case, r could be in shape_of.values(), that is, r itself
         # is the shape of  something. In that case, we want to update
         # the value in shape_of, to keep it up-to-date.
-        for v in self.shape_of_reverse_index.get(r, []):
+        for v in list(self.shape_of_reverse_index.get(r, ())):
             # The reverse index is only approximate. It is not updated on
-            # deletion of variables, or on change_input so it might be the
-            # case that there are a few extra `v`'s in it that no longer have
-            # a shape of r or possibly have been deleted from shape_of
-            # entirely. The important thing is that it permits to recall
-            # all variables with r in their shape.
+            # change_input so it might be the case that there are a few extra
+            # `v`'s in it that no longer have a shape of r or possibly have been
+            # deleted from shape_of entirely. The important thing is that it
+            # permits to recall all variables with r in their shape.
             for ii, svi in enumerate(self.shape_of.get(v, [])):
                 if svi == r:
                     self.set_shape_i(v, ii, new_r)
-        self.shape_of_reverse_index[r] = set()
+        self.shape_of_reverse_index.pop(r, None)
 
     def same_shape(
         self,
@@ -694,33 +870,56 @@ class ShapeFeature(Feature):
         if len(sx) != len(sy):
             return False
 
-        # Canonicalize the graphs so that comparisons are reasonable
-        # TODO FIXME: This should *not* need to be performed manually here.
-        # Instead, the shape information in `self.shape_of` should be operated
-        # upon alongside all the other elements in a `FunctionGraph` (e.g. as
-        # if `self.shape_of.values()` were additional outputs).
-        shapes_fg = FunctionGraph(
-            outputs=sx + sy,
-            # features=[self],
-            clone=True,
-            # copy_inputs=False,
-        )
-        from aesara.graph.rewriting.utils import rewrite_graph
+        # Most dimensions are trivially equal (or trivially different), so
+        # only the remaining ones are canonicalized before being compared
+        xs: List[Variable] = []
+        ys: List[Variable] = []
+        for dx, dy in zip(sx, sy):
+            res = _dims_trivially_equal(dx, dy)
+            if res is None:
+                xs.append(dx)
+                ys.append(dy)
+            elif not res:
+                return False
 
-        canon_shapes_fg = type_cast(
-            FunctionGraph,
-            rewrite_graph(shapes_fg, custom_rewrite=topo_constant_folding),
-        )
-        canon_shapes = canon_shapes_fg.outputs
+        if not xs:
+            return True
 
-        sx_ = canon_shapes[: len(sx)]
-        sy_ = canon_shapes[len(sx) :]
+        canon_vars = self._canonicalize_shape_vars(xs + ys)
+        n = len(xs)
+        return equal_computations(canon_vars[:n], canon_vars[n:])
 
-        for dx, dy in zip(sx_, sy_):
-            if not equal_computations([dx], [dy]):
-                return False
+    def _canonicalize_shape_vars(self, shape_vars: List[Variable]) -> List[Variable]:
+        """Return constant folded versions of the shape elements `shape_vars`.
 
-        return True
+        The results are cached until the graph changes, and the elements that
+        aren't cached yet are folded together.
+
+        """
+        cache = self._canon_shape_cache
+        misses = [
+            sv
+            for sv in dict.fromkeys(shape_vars)
+            if sv not in cache and not isinstance(sv, Constant)
+        ]
+
+        if misses:
+            # TODO FIXME: This should *not* need to be performed manually here.
+            # Instead, the shape information in `ShapeFeature.shape_of` should be
+            # operated upon alongside all the other elements in a `FunctionGraph`
+            # (e.g. as if `ShapeFeature.shape_of.values()` were additional outputs).
+            # The graph inputs aren't copied, so that the folded results of
+            # distinct calls can be compared with each other.
+            shapes_fg = FunctionGraph(outputs=misses, clone=True, copy_inputs=False)
+            from aesara.graph.rewriting.utils import rewrite_graph
+
+            canon_shapes_fg = type_cast(
+                FunctionGraph,
+                rewrite_graph(shapes_fg, custom_rewrite=topo_constant_folding),
+            )
+            cache.update(zip(misses, canon_shapes_fg.outputs))
+
+        return [cache.get(sv, sv) for sv in shape_vars]
 
     def clone(self):
         return type(self)()
@@ -783,10 +982,10 @@ def local_reshape_chain(op):
         # We should try to figure out why we lost the information about this
         # constant value... but in the meantime, better not apply this
         # rewrite.
-        if rval.type.ndim == node.outputs[0].type.ndim and all(
-            s1 == s1
-            for s1, s2 in zip(rval.type.shape, node.outputs[0].type.shape)
-            if s1 == 1 or s2 == 1
+        out_shape = node.outputs[0].type.shape
+        rval_shape = rval.type.shape
+        if len(rval_shape) == len(out_shape) and all(
+            s1 == s2 for s1, s2 in zip(rval_shape, out_shape) if s1 == 1 or s2 == 1
         ):
             return [rval]
         else:
@@ -840,67 +1039,129 @@ def local_useless_reshape(fgraph, node):
     # Match Reshape(x, [x.shape[0], ..., x.shape[-1]]), accounting for
     # broadcastable and constant dimensions
     if output_shape.owner and isinstance(output_shape.owner.op, MakeVector):
-        output_shape_is = output_shape.owner.inputs
-
         shape_feature = getattr(fgraph, "shape_feature", None)
 
-        nb_m1 = 0
-        shape_match = [False] * inp.type.ndim
-        for dim in range(inp.type.ndim):
-            outshp_i = output_shape_is[dim]
+        if shape_feature is None or node not in fgraph.apply_nodes:
+            # Nodes outside of the graph aren't cached, since the
+            # `ShapeFeature` would never see their keys become stale
+            is_useless = _reshape_matches_input_shape(
+                fgraph, shape_feature, inp, output_shape
+            )
+        else:
+            # The result only changes when the graph or the shape information
+            # changes, and the `ShapeFeature` clears this cache when it does
+            cache = shape_feature.useless_reshape_cache
+            key = (inp, output_shape)
+            is_useless = cache.get(key)
+            if is_useless is None:
+                is_useless = cache[key] = _reshape_matches_input_shape(
+                    fgraph, shape_feature, inp, output_shape
+                )
+
+        if is_useless:
+            return [inp]
+
+        # TODO later: if all the shapes except one match, we may want to
+        # consider it useless as well, like we do in the 1-dim case.
+        return False
+
+
+def _reshape_matches_input_shape(
+    fgraph: FunctionGraph,
+    shape_feature: Optional[ShapeFeature],
+    inp: Variable,
+    output_shape: Variable,
+) -> bool:
+    """Determine whether or not the `MakeVector` `output_shape` is the shape of `inp`."""
+    output_shape_is = output_shape.owner.inputs
+
+    inp_static_shape = inp.type.shape
+
+    # Each dimension must match one of the rules below, so this stops at the
+    # first one that doesn't
+    nb_m1 = 0
+    for dim in range(inp.type.ndim):
+        outshp_i = output_shape_is[dim]
+        outshp_i_node = outshp_i.owner
+        if outshp_i_node is not None:
+            outshp_i_op = outshp_i_node.op
             # Match Shape_i{dim}(input)
             if (
-                outshp_i.owner
-                and isinstance(outshp_i.owner.op, Shape_i)
-                and outshp_i.owner.op.i == dim
-                and outshp_i.owner.inputs[0] == inp
+                isinstance(outshp_i_op, Shape_i)
+                and outshp_i_op.i == dim
+                and outshp_i_node.inputs[0] == inp
             ):
-                shape_match[dim] = True
                 continue
 
             # Match Shape(input)[dim]
             if (
-                outshp_i.owner
-                and isinstance(outshp_i.owner.op, Subtensor)
-                and len(outshp_i.owner.inputs) == 2
-                and extract_constant(outshp_i.owner.inputs[1]) == dim
+                isinstance(outshp_i_op, Subtensor)
+                and len(outshp_i_node.inputs) == 2
+                and extract_constant(outshp_i_node.inputs[1]) == dim
             ):
-                subtensor_inp = outshp_i.owner.inputs[0]
+                subtensor_inp = outshp_i_node.inputs[0]
                 if subtensor_inp.owner and isinstance(subtensor_inp.owner.op, Shape):
                     shape_input_i = subtensor_inp.owner.inputs[0]
                     if shape_input_i == inp:
-                        shape_match[dim] = True
                         continue
 
-            # Match 1 if input.type.shape[dim] == 1
-            cst_outshp_i = extract_constant(outshp_i, only_process_constants=1)
-            if inp.type.shape[dim] == 1 and cst_outshp_i == 1:
-                shape_match[dim] = True
-                continue
+        # The constant value of `outshp_i` is used by all the remaining checks
+        cst_outshp_i = extract_constant(outshp_i, only_process_constants=1)
 
-            # Match -1
-            if cst_outshp_i == -1:
-                shape_match[dim] = True
-                nb_m1 += 1
-                continue
+        # Match 1 if input.type.shape[dim] == 1
+        if inp_static_shape[dim] == 1 and cst_outshp_i == 1:
+            continue
 
-            # Match shape_of[input][dim] or its constant equivalent
-            if shape_feature:
+        # Match -1
+        if cst_outshp_i == -1:
+            nb_m1 += 1
+            if nb_m1 > 1:
+                return False
+            continue
+
+        # Match shape_of[input][dim] or its constant equivalent
+        if shape_feature:
+            # `Reshape`s of the same input ask for the same shapes
+            get_shape_cache = shape_feature.get_shape_cache
+            inpshp_i = get_shape_cache.get((inp, dim))
+            if inpshp_i is None:
                 inpshp_i = shape_feature.get_shape(fgraph, inp, dim)
-                if inpshp_i == outshp_i or (
-                    extract_constant(inpshp_i, only_process_constants=1)
-                    == extract_constant(outshp_i, only_process_constants=1)
-                ):
-                    shape_match[dim] = True
-                    continue
+                get_shape_cache[(inp, dim)] = inpshp_i
+            if inpshp_i == outshp_i or (
+                extract_constant(inpshp_i, only_process_constants=1) == cst_outshp_i
+            ):
+                continue
 
-        if all(shape_match) and nb_m1 <= 1:
-            return [inp]
+        return False
 
-        # TODO later: if all the shapes except one match, we may want to
-        # consider it useless as well, like we do in the 1-dim case.
+    return True
+
+
+def _may_be_one(s: Variable) -> bool:
+    """Return ``False`` if the shape element `s` is known not to be the constant 1.
+
+    This is a cheap, conservative check: ``True`` only means that
+    `extract_constant` needs to be consulted.
+
+    """
+    if isinstance(s, Constant):
+        return bool(s.data == 1)
+
+    node = s.owner
+    if node is None:
         return False
 
+    if isinstance(node.op, Shape_i):
+        # `extract_constant` only uses the static shape of non-constant inputs
+        x = node.inputs[0]
+        return (
+            isinstance(x, Constant)
+            or not isinstance(x.type, HasShape)
+            or x.type.shape[node.op.i] == 1
+        )
+
+    return True
+
 
 @register_canonicalize
 @node_rewriter([Reshape])
@@ -921,16 +1182,32 @@ def local_reshape_to_dimshuffle(fgraph, node):
     output = node.outputs[0]
     output_shape = node.inputs[1]
 
+    if output_shape.owner is not None and isinstance(output_shape.owner.op, MakeVector):
+        shape_elems = output_shape.owner.inputs
+        # Cheaply rule out the shapes with no dimension that could be 1
+        if not any(_may_be_one(s) for s in shape_elems):
+            return None
+    else:
+        shape_elems = None
+
     dimshuffle_new_order = []
     new_output_shape = []
     index = 0  # index over the output of the new reshape
     for i in range(output.ndim):
-        # Since output_shape is a symbolic vector, we trust extract_constant
-        # to go through however it is formed to see if its i-th element is 1.
-        # We need only_process_constants=False for that.
-        dim = extract_constant(
-            output_shape[i], only_process_constants=False, elemwise=False
-        )
+        if shape_elems is not None:
+            # Use the `MakeVector` entries directly instead of indexing
+            # `output_shape` and having `extract_constant` look through the
+            # new `Subtensor` (which it does with the default `elemwise`)
+            dim = shape_elems[i]
+            if _may_be_one(dim):
+                dim = extract_constant(dim, only_process_constants=False)
+        else:
+            # Since output_shape is a symbolic vector, we trust extract_constant
+            # to go through however it is formed to see if its i-th element is 1.
+            # We need only_process_constants=False for that.
+            dim = extract_constant(
+                output_shape[i], only_process_constants=False, elemwise=False
+            )
         if dim == 1:
             dimshuffle_new_order.append("x")
         else:
@@ -940,14 +1217,12 @@ def local_reshape_to_dimshuffle(fgraph, node):
 
     if index != output.type.ndim:
         inner = op.__class__(len(new_output_shape))(inp, new_output_shape)
-        copy_stack_trace(output, inner)
-        new_node = [
-            DimShuffle(tuple(s == 1 for s in inner.type.shape), dimshuffle_new_order)(
-                inner
-            )
-        ]
-        copy_stack_trace(output, new_node)
-        return new_node
+        new_out = DimShuffle(
+            tuple(s == 1 for s in inner.type.shape), dimshuffle_new_order
+        )(inner)
+        # Copy the stack trace to all the new variables at once
+        copy_stack_trace(output, [inner, new_out])
+        return [new_out]
 
 
 @register_canonicalize
@@ -963,18 +1238,18 @@ def local_reshape_lift(fgraph, node):
     when there is a reshape.
 
     """
+    inp_node = node.inputs[0].owner
     if (
-        isinstance(node.op, Reshape)
-        and node.inputs[0].owner
-        and isinstance(node.inputs[0].owner.op, Elemwise)
-        and len(node.inputs[0].owner.inputs) == 1
+        inp_node is not None
+        and isinstance(inp_node.op, Elemwise)
+        and len(inp_node.inputs) == 1
     ):
-        r = node.op(node.inputs[0].owner.inputs[0], node.inputs[1])
+        r = node.op(inp_node.inputs[0], node.inputs[1])
         # Copy stacktrace from previous Reshape op, as an error in new
         # Reshape op could only have been caused by old one.
         copy_stack_trace(node.outputs, r)
 
-        e = node.inputs[0].owner.op(r)
+        e = inp_node.op(r)
         # Copy stacktrace from both previous Reshape and UnaryElemwise op
         # because an error in new cg could have been caused by either ops.
         copy_stack_trace(node.outputs + node.inputs, e)
@@ -989,15 +1264,17 @@ def local_merge_consecutive_specify_shape(fgraph, node):
     where s3 is the union of specified dimensions in s1 and s2, with preference given to s2.
     """
 
-    if not isinstance(node.op, SpecifyShape):
+    obj_node = node.inputs[0].owner
+    if obj_node is None or not isinstance(obj_node.op, SpecifyShape):
         return False
 
-    obj = node.inputs[0]
-    if not (obj.owner and isinstance(obj.owner.op, SpecifyShape)):
-        return False
+    outer_shape = node.inputs[1:]
+    if all(NoneConst.equals(sh) for sh in outer_shape):
+        # The inner `SpecifyShape` already specifies everything
+        return [node.inputs[0]]
 
-    inner_obj, *shape = obj.owner.inputs
-    for dim, sh in enumerate(node.inputs[1:]):
+    inner_obj, *shape = obj_node.inputs
+    for dim, sh in enumerate(outer_shape):
         if not NoneConst.equals(sh):
             shape[dim] = sh
 
@@ -1013,21 +1290,23 @@ def local_merge_consecutive_specify_shape(fgraph, node):
 def local_Shape_of_SpecifyShape(fgraph, node):
     """Replace ``specify_shape(x, s).shape`` with ``s``."""
 
-    if not isinstance(node.op, Shape):
-        return False
-
-    specified_shape = node.inputs[0]
+    specified_shape_node = node.inputs[0].owner
 
-    if not isinstance(getattr(specified_shape.owner, "op", None), SpecifyShape):
+    if specified_shape_node is None or not isinstance(
+        specified_shape_node.op, SpecifyShape
+    ):
         return False
 
-    x, *shape = specified_shape.owner.inputs
+    x, *shape = specified_shape_node.inputs
 
     # Replace `NoneConst` by `shape_i`
     for i, sh in enumerate(shape):
         if NoneConst.equals(sh):
             shape[i] = shape_i(x, i, fgraph)
 
+    if all(isinstance(sh, Constant) for sh in shape):
+        return [as_tensor_variable(np.array([sh.data for sh in shape], dtype=np.int64))]
+
     return [stack(shape).astype(np.int64)]
 
 
@@ -1037,9 +1316,6 @@ def local_Shape_of_SpecifyShape(fgraph, node):
 def local_Shape_i_ground(fgraph, node):
     """Replace ``shape_i(x, i)`` with ``s`` when ``x.type.shape[i] == s``."""
 
-    if not isinstance(node.op, Shape_i):
-        return False
-
     shape_arg = node.inputs[0]
 
     if not isinstance(shape_arg.type, TensorType):
@@ -1069,21 +1345,18 @@ def local_shape_to_shape_i(fgraph, node):
 @register_canonicalize
 @node_rewriter([Shape_i])
 def local_track_shape_i(fgraph, node):
-    if not isinstance(node.op, Shape_i):
-        return False
-
     try:
         shape_feature = fgraph.shape_feature
     except AttributeError:
         return False
 
-    if node not in shape_feature.scheduled:
-        return False
-
     # Don't unschedule node as it could be reinserted in the
     # fgraph as we don't change it in the shapefeature internal
     # structure.
-    replacement = shape_feature.scheduled[node]
+    replacement = shape_feature.scheduled.get(node)
+    if replacement is None:
+        return False
+
     return [shape_feature.shape_of[replacement][node.op.i]]
 
 
@@ -1100,24 +1373,16 @@ def local_useless_dimshuffle_in_reshape(fgraph, node):
 
     """
     op = node.op
-    if not isinstance(op, Reshape):
-        return False
-    if not (
-        node.inputs[0].owner is not None
-        and isinstance(node.inputs[0].owner.op, DimShuffle)
-    ):
+    inp_node = node.inputs[0].owner
+    if not (inp_node is not None and isinstance(inp_node.op, DimShuffle)):
         return False
 
-    new_order = node.inputs[0].owner.op.new_order
-    inp = node.inputs[0].owner.inputs[0]
-    new_order_of_nonbroadcast = []
-    for i, s in zip(new_order, node.inputs[0].type.shape):
-        if s != 1:
-            new_order_of_nonbroadcast.append(i)
-    no_change_in_order = all(
-        new_order_of_nonbroadcast[i] <= new_order_of_nonbroadcast[i + 1]
-        for i in range(len(new_order_of_nonbroadcast) - 1)
-    )
+    new_order = inp_node.op.new_order
+    inp = inp_node.inputs[0]
+    new_order_of_nonbroadcast = [
+        i for i, s in zip(new_order, node.inputs[0].type.shape) if s != 1
+    ]
+    no_change_in_order = new_order_of_nonbroadcast == sorted(new_order_of_nonbroadcast)
     if no_change_in_order:
         shape = node.inputs[1]
         ret = op.__class__(node.outputs[0].ndim)(inp, shape)
@@ -1134,28 +1399,28 @@ def local_useless_unbroadcast(fgraph, node):
 
     TODO: Implement equivalent rewrite for SpecifyShape
     """
-    if isinstance(node.op, Unbroadcast):
-        x = node.inputs[0]
-        if x.type.ndim == node.outputs[0].type.ndim and all(
-            s1 == s2
-            for s1, s2 in zip(x.type.shape, node.outputs[0].type.shape)
-            if s1 == 1 or s2 == 1
-        ):
-            # No broadcastable flag was modified
-            # No need to copy over stack trace,
-            # because x should already have a stack trace.
-            return [x]
+    x = node.inputs[0]
+    x_shape = x.type.shape
+    if x.type.ndim == node.outputs[0].type.ndim and all(
+        s1 == s2
+        for s1, s2 in zip(x_shape, node.outputs[0].type.shape)
+        if s1 == 1 or s2 == 1
+    ):
+        # No broadcastable flag was modified
+        # No need to copy over stack trace,
+        # because x should already have a stack trace.
+        return [x]
+    else:
+        # Keep the flags that modify something
+        new_axes = tuple(ax for ax in node.op.axes if x_shape[ax] == 1)
+        if new_axes == node.op.axes:
+            # All flags are useful
+            return None
         else:
-            # Keep the flags that modify something
-            new_axes = tuple(ax for ax in node.op.axes if x.type.shape[ax] == 1)
-            if new_axes == node.op.axes:
-                # All flags are useful
-                return None
-            else:
-                r = unbroadcast(x, *new_axes)
-                # Copy over stacktrace from previous output
-                copy_stack_trace(node.outputs, r)
-                return [r]
+            r = unbroadcast(x, *new_axes)
+            # Copy over stacktrace from previous output
+            copy_stack_trace(node.outputs, r)
+            return [r]
 
 
 @register_canonicalize
@@ -1172,9 +1437,6 @@ def local_unbroadcast_lift(fgraph, node):
     TODO: Implement equivalent Elemwise lift for SpecifyShape
     """
     op = node.op
-    if not isinstance(op, Unbroadcast):
-        return False
-
     inp = node.inputs[0]
     inode = inp.owner
     if inode and isinstance(inode.op, Elemwise) and len(inode.inputs) == 1:
@@ -1193,7 +1455,7 @@ def local_unbroadcast_lift(fgraph, node):
 
     if inode and isinstance(inode.op, Unbroadcast):
         # Merge axis of each unbroadcast
-        axis = tuple(set(inode.op.axes).union(set(op.axes)))
+        axis = sorted({*inode.op.axes, *op.axes})
         iinput = inode.inputs[0]
         rval = [unbroadcast(iinput, *axis)]
         # Copy over stacktrace from previous output (after second unbroadcasting)
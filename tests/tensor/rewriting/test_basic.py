@@ -1592,6 +1592,23 @@ def test_local_merge_consecutive_specify_shape2():
     assert tuple(y_rewritten.owner.inputs) == (x, s1, s3, s4)
 
 
+def test_local_merge_consecutive_specify_shape_no_outer_info():
+    x = matrix()
+    s1, s2 = iscalars("s1", "s2")
+    y = SpecifyShape()(specify_shape(x, [s1, s2]), None, None)
+
+    y_fg = FunctionGraph(outputs=[y], copy_inputs=False)
+    y_rewritten_fg = rewrite_graph(
+        y_fg,
+        clone=False,
+        include=["canonicalize", "local_merge_consecutive_specify_shape"],
+    )
+    y_rewritten = y_rewritten_fg.outputs[0]
+
+    assert isinstance(y_rewritten.owner.op, SpecifyShape)
+    assert tuple(y_rewritten.owner.inputs) == (x, s1, s2)
+
+
 def test_printing():
     a, b = scalars("ab")
     mv = MakeVector(config.floatX)
@@ -1,4 +1,5 @@
 import copy
+import pickle
 
 import numpy as np
 import pytest
@@ -9,7 +10,7 @@ from aesara.compile.function import function
 from aesara.compile.mode import get_default_mode, get_mode
 from aesara.compile.ops import deep_copy_op
 from aesara.configdefaults import config
-from aesara.graph.basic import Apply, Variable, equal_computations
+from aesara.graph.basic import Apply, Constant, Variable, equal_computations
 from aesara.graph.fg import FunctionGraph
 from aesara.graph.op import Op
 from aesara.graph.rewriting.basic import check_stack_trace, node_rewriter, out2in
@@ -21,6 +22,7 @@ from aesara.tensor.math import add, exp, maximum
 from aesara.tensor.rewriting.basic import register_specialize
 from aesara.tensor.rewriting.shape import (
     ShapeFeature,
+    local_reshape_chain,
     local_reshape_to_dimshuffle,
     local_useless_reshape,
 )
@@ -37,6 +39,7 @@ from aesara.tensor.type import (
     fmatrix,
     iscalar,
     lscalar,
+    lvector,
     matrix,
     scalar,
     tensor,
@@ -240,6 +243,54 @@ class TestShapeRewriter:
         f([[1, 2], [2, 3]])
 
 
+def test_ShapeFeature_get_shape_stale():
+    """Make sure that stale shapes are updated without recursion."""
+    x = vector()
+    outs = [x]
+    for i in range(2000):
+        outs.append(exp(outs[-1]))
+
+    fgraph = FunctionGraph([x], [outs[-1]], clone=False)
+    shape_feature = ShapeFeature()
+    fgraph.attach_feature(shape_feature)
+
+    # Make every shape refer to a variable that isn't in the graph
+    y = vector()
+    for out in outs[1:]:
+        shape_feature.set_shape(out, (Shape_i(0)(y),), override=True)
+
+    res = shape_feature.get_shape(fgraph, outs[-1], 0)
+    assert isinstance(res.owner.op, Shape_i)
+    assert res.owner.inputs[0] is x
+    assert shape_feature.shape_of[outs[1]][0] is shape_feature.shape_of[x][0]
+
+
+def test_ShapeFeature_reverse_index_pickle():
+    x = vector()
+    y = exp(x)
+    fgraph = FunctionGraph([x], [y], clone=False, features=[ShapeFeature()])
+
+    (y_shape,) = fgraph.shape_feature.shape_of[y]
+    assert y in fgraph.shape_feature.shape_of_reverse_index[y_shape]
+
+    fgraph_2 = pickle.loads(pickle.dumps(fgraph))
+    shape_feature_2 = fgraph_2.shape_feature
+    (y_2,) = fgraph_2.outputs
+    (y_2_shape,) = shape_feature_2.shape_of[y_2]
+    assert y_2 in shape_feature_2.shape_of_reverse_index[y_2_shape]
+
+
+def test_ShapeFeature_interned_constants():
+    x = tensor("float64", shape=(3, 2))
+    y = tensor("float64", shape=(2, 3))
+    fgraph = FunctionGraph([x, y], [exp(x), exp(y)], features=[ShapeFeature()])
+    shape_feature = fgraph.shape_feature
+
+    x, y = fgraph.inputs
+    assert shape_feature.shape_of[x][0] is shape_feature.shape_of[y][1]
+    assert shape_feature.shape_of[x][1] is shape_feature.shape_of[y][0]
+
+
 class TestReshape:
     def setup_method(self):
         self.mode = rewrite_mode
@@ -256,6 +307,17 @@ class TestReshape:
         # Check stack trace
         assert check_stack_trace(f, ops_to_check=[self.op])
 
+    def test_local_reshape_broadcastable_mismatch(self):
+        x = matrix()
+        s1 = lvector()
+        s2 = lvector()
+        b = self.op(2)(x, s1)
+        # The output has a broadcastable dimension that can't be inferred from
+        # `s2` alone
+        node = Apply(self.op(2), [b, s2], [tensor(x.dtype, shape=(1, None))])
+
+        assert local_reshape_chain(self.op).transform(None, node) is False
+
 
 class TestLocalUselessReshape:
     def setup_method(self):
@@ -317,6 +379,36 @@ class TestLocalUselessReshape:
         topo = f2.maker.fgraph.toposort()
         assert not any(isinstance(n.op, Reshape) for n in topo)
 
+    def test_cache_skips_outside_nodes(self):
+        x = matrix("x")
+        fgraph = FunctionGraph([x], [exp(x)], features=[ShapeFeature()], clone=False)
+        shape_feature = fgraph.shape_feature
+        cache = shape_feature.useless_reshape_cache
+
+        # `Reshape`s that aren't in `fgraph` are matched, but not cached
+        r = x.reshape([Shape_i(i)(x) for i in range(x.ndim)])
+        r_shape = r.owner.inputs[1]
+        assert local_useless_reshape.transform(fgraph, r.owner) == [x]
+        assert (x, r_shape) not in cache
+
+        r_2 = x.reshape([Shape_i(1)(x), Shape_i(0)(x)])
+        r_2_shape = r_2.owner.inputs[1]
+        assert not local_useless_reshape.transform(fgraph, r_2.owner)
+        assert not cache
+
+        # The same nodes are matched and cached once they're in `fgraph`
+        fgraph.add_output(r)
+        fgraph.add_output(r_2)
+        assert local_useless_reshape.transform(fgraph, r.owner) == [x]
+        assert cache[(x, r_shape)] is True
+        assert not local_useless_reshape.transform(fgraph, r_2.owner)
+        assert cache[(x, r_2_shape)] is False
+
+        # The cached results are reused
+        assert local_useless_reshape.transform(fgraph, r.owner) == [x]
+        assert not local_useless_reshape.transform(fgraph, r_2.owner)
+        assert len(cache) == 2
+
 
 class TestLocalReshapeToDimshuffle:
     def setup_method(self):
@@ -353,6 +445,27 @@ class TestLocalReshapeToDimshuffle:
 
         assert check_stack_trace(g, ops_to_check=(DimShuffle, Reshape))
 
+    def test_useless_inner_reshape(self):
+        x = vector()
+        reshape_x = reshape(x, (1, x.shape[0]))
+
+        g = FunctionGraph([x], [reshape_x], clone=False)
+        out2in(local_reshape_to_dimshuffle).rewrite(g)
+
+        # The inner `Reshape` is left to `local_useless_reshape`
+        (out,) = g.outputs
+        assert isinstance(out.owner.op, DimShuffle)
+        assert isinstance(out.owner.inputs[0].owner.op, Reshape)
+
+        # ...so that excluding it by name keeps the inner `Reshape`
+        reshape_x = reshape(x, (1, x.shape[0]))
+        g = FunctionGraph([x], [reshape_x], clone=False)
+        rewrite_graph(g, include=["canonicalize"], exclude=["local_useless_reshape"])
+
+        (out,) = g.outputs
+        assert isinstance(out.owner.op, DimShuffle)
+        assert isinstance(out.owner.inputs[0].owner.op, Reshape)
+
 
 def test_local_reshape_lift():
     x = tensor4()
@@ -445,6 +558,26 @@ class TestSameShape:
         assert shape_feature.same_shape(x, o, 0, 0)
         assert not shape_feature.same_shape(x, o, 1, 1)
 
+    def test_canonicalized_dims(self):
+        x = vector()
+        y = vector()
+        fgraph = FunctionGraph([x, y], [x, y], clone=False)
+        shape_feature = ShapeFeature()
+        fgraph.attach_feature(shape_feature)
+
+        three = at.as_tensor_variable(np.int64(3))
+        one_plus_two = at.as_tensor_variable(np.int64(1)) + at.as_tensor_variable(
+            np.int64(2)
+        )
+        shape_feature.set_shape(x, (three,), override=True)
+        shape_feature.set_shape(y, (one_plus_two,), override=True)
+        assert shape_feature.same_shape(x, y)
+        # The cached comparison gives the same answer
+        assert shape_feature.same_shape(y, x)
+
+        shape_feature.set_shape(x, (at.as_tensor_variable(np.int64(4)),), override=True)
+        assert not shape_feature.same_shape(x, y)
+
     def test_vector_dim_err(self):
         x = vector()
         y = vector()
@@ -491,6 +624,19 @@ def test_local_Shape_of_SpecifyShape_partial(s1):
     assert not any(isinstance(apply.op, SpecifyShape) for apply in fgraph.apply_nodes)
 
 
+def test_local_Shape_of_SpecifyShape_constant():
+    x = matrix()
+    s = specify_shape(x, (2, 3)).shape
+
+    fgraph = FunctionGraph(outputs=[s], clone=False)
+    _ = rewrite_graph(fgraph, clone=False)
+
+    (s_rewritten,) = fgraph.outputs
+    assert isinstance(s_rewritten, Constant)
+    assert s_rewritten.dtype == "int64"
+    assert np.array_equal(s_rewritten.data, [2, 3])
+
+
 def test_local_Shape_i_ground():
     x = tensor(np.float64, shape=(None, 2))
     s = Shape_i(1)(x)
@@ -1,6 +1,7 @@
 """Test config options."""
 import configparser as stdlib_configparser
 import io
+import os
 import pickle
 
 import pytest
@@ -106,13 +107,13 @@ def test_config_param_apply_and_validation():
         mutable=True,
     )
     assert cp.default == "TheDeFauLt"
-    assert not hasattr(cp, "val")
+    assert cp.val is configparser._MISSING
 
     # can't assign invalid value
     with pytest.raises(ValueError, match="Invalid value"):
         cp.__set__("cls", "invalid")
 
-    assert not hasattr(cp, "val")
+    assert cp.val is configparser._MISSING
 
     # effectivity of apply function
     cp.__set__("cls", "THESETTING")
@@ -142,6 +143,94 @@ def test_config_hash():
     assert h1 != h0
     assert h2 == h0
 
+    # Setting the current value doesn't change the config
+    version = root._config_version
+    with root.change_flags(test__config_hash="test_default"):
+        assert root._config_version == version
+        assert root.get_config_hash() == h0
+
+    # Parameters outside of the C key don't change the hash
+    root.add(
+        "test__config_hash_not_in_c_key",
+        "A config var from a test case.",
+        configparser.StrParam("test_default"),
+        in_c_key=False,
+    )
+    with root.change_flags(test__config_hash_not_in_c_key="new_value"):
+        assert root.get_config_hash() == h0
+
+    # New parameters in the C key do
+    root.add(
+        "test__config_hash_2",
+        "A config var from a test case.",
+        configparser.StrParam("test_default"),
+    )
+    assert root.get_config_hash() != h0
+
+
+def test_read_config_files(tmp_path):
+    rc_file = tmp_path / "aesararc"
+    rc_file.write_text("[global]\nfloatX = float32\n")
+    config_files = [str(rc_file), str(tmp_path / "missing")]
+
+    cfg = configparser._read_config_files(
+        stdlib_configparser.ConfigParser, {"PID": "1"}, config_files
+    )
+    assert cfg.get("global", "floatX") == "float32"
+
+    # The parsed files are reused while they are unchanged
+    assert (
+        configparser._read_config_files(
+            stdlib_configparser.ConfigParser, {"PID": "1"}, config_files
+        )
+        is cfg
+    )
+    assert (
+        configparser._read_config_files(
+            stdlib_configparser.ConfigParser, {"PID": "2"}, config_files
+        )
+        is not cfg
+    )
+
+    rc_file.write_text("[global]\nfloatX = float64\ndevice = cpu\n")
+    cfg = configparser._read_config_files(
+        stdlib_configparser.ConfigParser, {"PID": "1"}, config_files
+    )
+    assert cfg.get("global", "floatX") == "float64"
+
+    # A rewrite that keeps the size is picked up through the modification time
+    stat = os.stat(rc_file)
+    rc_file.write_text("[global]\nfloatX = float16\ndevice = cpu\n")
+    os.utime(rc_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    cfg = configparser._read_config_files(
+        stdlib_configparser.ConfigParser, {"PID": "1"}, config_files
+    )
+    assert cfg.get("global", "floatX") == "float16"
+
+    # Only the latest parse of the files is kept for each set of defaults
+    cached = [
+        parser
+        for key, (_, parser) in configparser._PARSED_RC_CACHE.items()
+        if key[2] == tuple(config_files)
+    ]
+    assert len(cached) == 2
+    assert cfg in cached
+
+
+@pytest.mark.parametrize(
+    "config_string, expected",
+    [
+        ("", {}),
+        ("floatX=float32, device = cpu,,", {"floatX": "float32", "device ": " cpu"}),
+        ("floatX=float32,floatX=float64", {"floatX": "float64"}),
+        ("a='b,c',d=1", {"a": "b,c", "d": "1"}),
+        ("a=b\\,c", {"a": "b,c"}),
+        ("a=1#,b=2", {"a": "1"}),
+    ],
+)
+def test_parse_config_string(config_string, expected):
+    assert configparser.parse_config_string(config_string) == expected
+
 
 def test_config_print():
     root = configdefaults.config
@@ -203,6 +292,19 @@ def test_config_context():
         assert root.test__config_context == "new_value"
     assert root.test__config_context == "test_default"
 
+    # The old values are restored without validating them again
+    validated = []
+    root.add(
+        "test__config_context_validate",
+        "A config var from a test case.",
+        configparser.StrParam("test_default", validate=validated.append),
+    )
+    assert validated == ["test_default"]
+    with root.change_flags(test__config_context_validate="new_value"):
+        assert validated == ["test_default", "new_value"]
+    assert root.test__config_context_validate == "test_default"
+    assert validated == ["test_default", "new_value"]
+
 
 def test_invalid_configvar_access():
     root = configdefaults.config